@@ -9,4 +9,46 @@ class Settings:
     MODEL_FOLDER = os.getenv("MODEL_FOLDER", "./models")
     OPENWEATHER_API_KEY = os.getenv("OPENWEATHER_API_KEY", "0e353b69178bef3dcaa9a2349e7ef65a")
 
+    # Diagnosis history listing and single-diagnosis cache
+    DIAGNOSIS_PAGE_SIZE = int(os.getenv("DIAGNOSIS_PAGE_SIZE", "20"))
+    DIAGNOSIS_MAX_PAGE_SIZE = int(os.getenv("DIAGNOSIS_MAX_PAGE_SIZE", "100"))
+    DIAGNOSIS_CACHE_SIZE = int(os.getenv("DIAGNOSIS_CACHE_SIZE", "512"))
+
+    # Stored prediction result: top-k classes with probabilities quantized to uint8 or float16
+    PROBABILITY_TOP_K = int(os.getenv("PROBABILITY_TOP_K", "3"))
+    PROBABILITY_DTYPE = os.getenv("PROBABILITY_DTYPE", "uint8")
+    # pesticide_recommendation edits show up after at most this many seconds
+    TREATMENT_CACHE_SECONDS = int(os.getenv("TREATMENT_CACHE_SECONDS", "600"))
+
+    # Browsers must revalidate /spray/best-time with If-None-Match; unchanged polls get a 304
+    SPRAY_CACHE_CONTROL = os.getenv("SPRAY_CACHE_CONTROL", "private, no-cache")
+
+    # Farm locations are grouped into lat/lon tiles rounded to this many decimals (2 ~= 1 km)
+    LOCATION_TILE_DECIMALS = int(os.getenv("LOCATION_TILE_DECIMALS", "2"))
+
+    # Retention / compaction of Weather_data and Spray_time_prediction
+    RETENTION_ENABLED = os.getenv("RETENTION_ENABLED", "true").lower() == "true"
+    RETENTION_HORIZON_DAYS = int(os.getenv("RETENTION_HORIZON_DAYS", "7"))
+    RETENTION_ARCHIVE = os.getenv("RETENTION_ARCHIVE", "true").lower() == "true"
+    RETENTION_BATCH_SIZE = int(os.getenv("RETENTION_BATCH_SIZE", "500"))
+    RETENTION_BATCH_PAUSE_SECONDS = float(os.getenv("RETENTION_BATCH_PAUSE_SECONDS", "0.2"))
+    RETENTION_INTERVAL_SECONDS = int(os.getenv("RETENTION_INTERVAL_SECONDS", "3600"))
+    # /maintenance endpoints require this in X-Admin-Token; they are disabled while it is unset
+    ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+
+    # Scheduled forecast prefetch for registered farm locations
+    PREFETCH_ENABLED = os.getenv("PREFETCH_ENABLED", "true").lower() == "true"
+    PREFETCH_INTERVAL_SECONDS = int(os.getenv("PREFETCH_INTERVAL_SECONDS", "10800"))
+    PREFETCH_MAX_AGE_SECONDS = int(os.getenv("PREFETCH_MAX_AGE_SECONDS", "10800"))
+    PREFETCH_ACTIVE_DAYS = int(os.getenv("PREFETCH_ACTIVE_DAYS", "14"))
+    PREFETCH_CONCURRENCY = int(os.getenv("PREFETCH_CONCURRENCY", "4"))
+    PREFETCH_RATE_PER_MINUTE = int(os.getenv("PREFETCH_RATE_PER_MINUTE", "50"))
+
+    def __init__(self):
+        # Fail at startup rather than inside /predict after the diagnosis row exists
+        if self.PROBABILITY_DTYPE not in ("uint8", "float16"):
+            raise ValueError(f"PROBABILITY_DTYPE must be 'uint8' or 'float16', got '{self.PROBABILITY_DTYPE}'")
+        if not 1 <= self.PROBABILITY_TOP_K <= 255:
+            raise ValueError(f"PROBABILITY_TOP_K must be between 1 and 255, got {self.PROBABILITY_TOP_K}")
+
 settings = Settings()
@@ -0,0 +1,252 @@
+# app/diagnosis_history.py
+import json
+import base64
+import time
+import datetime
+import threading
+from collections import OrderedDict
+from app.db import get_db_connection
+from app.config import settings
+from app.ml_integration import MODEL_CONFIG
+from app.prediction_codec import decode_probabilities
+
+# Slim listing columns; every composite index below ends with them so list pages never touch the row
+SLIM_COLUMNS = ["id", "username", "crop", "disease_name", "confidence", "created_at"]
+FULL_COLUMNS = SLIM_COLUMNS + ["image_path", "probs_blob", "extra_json", "updated_at"]
+
+# (name, columns) - equality filters first, then the (created_at, id) keyset
+DIAGNOSIS_INDEXES = [
+    ("idx_diag_user_created", "username, created_at, id, crop, disease_name, confidence"),
+    ("idx_diag_user_crop_created", "username, crop, created_at, id, disease_name, confidence"),
+    ("idx_diag_user_disease_created", "username, disease_name, created_at, id, crop, confidence"),
+    ("idx_diag_created", "created_at, id, username, crop, disease_name, confidence"),
+]
+
+# Set once crop / probs_blob exist; until then /predict writes the legacy extra_json row
+SCHEMA_READY = threading.Event()
+
+class SchemaNotReady(Exception):
+    pass
+
+# === CACHES ===
+_CACHE = OrderedDict()
+_CACHE_LOCK = threading.Lock()
+# pesticide_recommendation rows: {disease: (expires_at, row)}, refreshed after TREATMENT_CACHE_SECONDS
+TREATMENTS = {}
+
+def _has_column(cursor, column):
+    cursor.execute("""
+        SELECT 1 FROM information_schema.COLUMNS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'plant_diagnosis' AND COLUMN_NAME = %s
+    """, (column,))
+    return cursor.fetchone() is not None
+
+def ensure_diagnosis_schema():
+    """
+    Add the crop / probs_blob columns and the composite indexes used by the history listing.
+    Runs in the background at startup (see start_schema_worker) or via `python -m app.diagnosis_history`.
+    """
+    conn = cursor = None
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        if not _has_column(cursor, "crop"):
+            cursor.execute("ALTER TABLE plant_diagnosis ADD COLUMN crop VARCHAR(32) NULL AFTER username")
+            backfill_crop(cursor)
+        if not _has_column(cursor, "probs_blob"):
+            cursor.execute("ALTER TABLE plant_diagnosis ADD COLUMN probs_blob VARBINARY(255) NULL AFTER confidence")
+
+        for name, columns in DIAGNOSIS_INDEXES:
+            cursor.execute("""
+                SELECT 1 FROM information_schema.STATISTICS
+                WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'plant_diagnosis' AND INDEX_NAME = %s
+                LIMIT 1
+            """, (name,))
+            if cursor.fetchone() is None:
+                cursor.execute(f"ALTER TABLE plant_diagnosis ADD INDEX {name} ({columns})")
+        conn.commit()
+        SCHEMA_READY.set()
+        print("plant_diagnosis history indexes ensured.")
+    except Exception as e:
+        print(f"Error ensuring diagnosis schema: {e}")
+    finally:
+        if cursor: cursor.close()
+        if conn: conn.close()
+    return SCHEMA_READY.is_set()
+
+def _schema_loop():
+    delay = 30
+    while not ensure_diagnosis_schema():
+        time.sleep(delay)
+        delay = min(delay * 2, 900)
+
+def start_schema_worker():
+    """Apply ensure_diagnosis_schema off the startup path, retrying until it succeeds."""
+    threading.Thread(target=_schema_loop, name="diagnosis-schema", daemon=True).start()
+
+def backfill_crop(cursor):
+    """Derive crop for existing rows from labels that belong to exactly one crop model."""
+    owners = {}
+    for crop_key, cfg in MODEL_CONFIG.items():
+        for label in cfg["classes"]:
+            owners.setdefault(label, set()).add(crop_key)
+
+    for crop_key, cfg in MODEL_CONFIG.items():
+        labels = [l for l in cfg["classes"] if owners[l] == {crop_key}]
+        if not labels: continue
+        placeholders = ", ".join(["%s"] * len(labels))
+        cursor.execute(
+            f"UPDATE plant_diagnosis SET crop = %s WHERE crop IS NULL AND disease_name IN ({placeholders})",
+            (crop_key, *labels)
+        )
+
+def encode_cursor(row):
+    raw = f"{row['created_at'].isoformat()}|{row['id']}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor_token):
+    """Returns (created_at, id); raises ValueError on a malformed token."""
+    padded = cursor_token + "=" * (-len(cursor_token) % 4)
+    created_at, row_id = base64.urlsafe_b64decode(padded.encode()).decode().split("|")
+    return datetime.datetime.fromisoformat(created_at), int(row_id)
+
+def get_treatment(disease):
+    """Treatment for a disease label from pesticide_recommendation, with the generic fallback."""
+    cached = TREATMENTS.get(disease)
+    if cached and cached[0] > time.monotonic():
+        return cached[1]
+
+    treatment, cacheable = None, True
+    conn = get_db_connection()
+    cursor = conn.cursor(dictionary=True)
+    try:
+        cursor.execute("SELECT * FROM pesticide_recommendation WHERE disease = %s", (disease,))
+        treatment = cursor.fetchone()
+    except Exception:
+        # Don't pin the fallback if the table is merely unavailable
+        cacheable = False
+    finally:
+        cursor.close()
+        conn.close()
+
+    if not treatment:
+        treatment = {
+            "disease": disease,
+            "chemical_pesticides": "Consult local expert",
+            "cause_prevention": "Ensure good field hygiene"
+        }
+    if cacheable: TREATMENTS[disease] = (time.monotonic() + settings.TREATMENT_CACHE_SECONDS, treatment)
+    return treatment
+
+def crop_classes(crop):
+    return MODEL_CONFIG.get(crop, {}).get("classes") if crop else None
+
+def decode_row(row):
+    """
+    Normalize image_path and unpack stored predictions. Compact rows get top_predictions
+    from probs_blob; rows not yet migrated get probabilities / treatment / model_used
+    from the legacy extra_json. Either way the raw columns are dropped.
+    """
+    if row.get("image_path"): row["image_path"] = row["image_path"].replace("\\", "/")
+    blob = row.pop("probs_blob", None)
+    extra = row.pop("extra_json", None)
+    if blob:
+        row["top_predictions"] = decode_probabilities(blob, crop_classes(row.get("crop")))
+    elif extra is not None:
+        try:
+            extra = json.loads(extra)
+        except (TypeError, ValueError):
+            extra = {}
+        row["probabilities"] = extra.get("probabilities", [])
+        row["treatment"] = extra.get("treatment")
+        row["model_used"] = extra.get("model_used")
+    return row
+
+def with_treatment(row):
+    """Compact rows reference their treatment; resolve it per response so cached rows stay fresh."""
+    if "top_predictions" in row:
+        return dict(row, treatment=get_treatment(row["disease_name"]))
+    return row
+
+def expand_row(row):
+    return with_treatment(decode_row(row))
+
+def _columns(full):
+    """Listing columns, minus crop / probs_blob until ensure_diagnosis_schema has added them."""
+    columns = FULL_COLUMNS if full else SLIM_COLUMNS
+    if SCHEMA_READY.is_set(): return columns
+    return [c for c in columns if c not in ("crop", "probs_blob")]
+
+def list_diagnoses(username=None, crop=None, disease=None, cursor_token=None, limit=None, full=False):
+    """
+    One page of diagnoses, newest first, keyset-paginated on (created_at, id).
+    Returns (rows, next_cursor); next_cursor is None on the last page.
+    """
+    limit = min(limit or settings.DIAGNOSIS_PAGE_SIZE, settings.DIAGNOSIS_MAX_PAGE_SIZE)
+    if crop and not SCHEMA_READY.is_set():
+        raise SchemaNotReady("crop filter is unavailable until the plant_diagnosis migration has run")
+    where, params = [], []
+    if username:
+        where.append("username = %s"); params.append(username)
+    if crop:
+        where.append("crop = %s"); params.append(crop)
+    if disease:
+        where.append("disease_name = %s"); params.append(disease)
+    if cursor_token:
+        created_at, row_id = decode_cursor(cursor_token)
+        where.append("(created_at < %s OR (created_at = %s AND id < %s))")
+        params.extend([created_at, created_at, row_id])
+
+    query = f"SELECT {', '.join(_columns(full))} FROM plant_diagnosis"
+    if where: query += " WHERE " + " AND ".join(where)
+    query += " ORDER BY created_at DESC, id DESC LIMIT %s"
+    params.append(limit + 1)
+
+    conn = get_db_connection()
+    cursor = conn.cursor(dictionary=True)
+    try:
+        cursor.execute(query, params)
+        rows = cursor.fetchall()
+    finally:
+        cursor.close()
+        conn.close()
+
+    next_cursor = encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+    rows = rows[:limit]
+    if full:
+        rows = [expand_row(r) for r in rows]
+    return rows, next_cursor
+
+def get_diagnosis_cached(diagnosis_id):
+    """
+    Single diagnosis, expanded exactly like a full /diagnoses row. The decoded row is
+    kept in a bounded LRU; the treatment is resolved per response.
+    """
+    with _CACHE_LOCK:
+        if diagnosis_id in _CACHE:
+            _CACHE.move_to_end(diagnosis_id)
+            return with_treatment(_CACHE[diagnosis_id])
+
+    conn = get_db_connection()
+    cursor = conn.cursor(dictionary=True)
+    try:
+        cursor.execute(f"SELECT {', '.join(_columns(True))} FROM plant_diagnosis WHERE id = %s", (diagnosis_id,))
+        row = cursor.fetchone()
+    finally:
+        cursor.close()
+        conn.close()
+    if not row: return None
+    row = decode_row(row)
+
+    with _CACHE_LOCK:
+        _CACHE[diagnosis_id] = row
+        while len(_CACHE) > settings.DIAGNOSIS_CACHE_SIZE:
+            _CACHE.popitem(last=False)
+    return with_treatment(row)
+
+def invalidate_diagnosis(diagnosis_id):
+    with _CACHE_LOCK:
+        _CACHE.pop(diagnosis_id, None)
+
+if __name__ == "__main__":
+    raise SystemExit(0 if ensure_diagnosis_schema() else 1)
@@ -0,0 +1,196 @@
+# app/forecast_scheduler.py
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from app.db import get_db_connection
+from app.config import settings
+from app.weather_service import (
+    fetch_forecast_weather, process_weather_blocks, capture_weather_on_login, weather_unique_key
+)
+from app.spray_prediction import score_records, run_spray_prediction
+
+# === STATE ===
+# Registered farm locations: {tile: {"lat", "lon", "last_seen"}}
+LOCATIONS = {}
+# Prefetched forecasts: {tile: {"fetched_at", "records", "status"}}; status is aligned with records
+FORECASTS = {}
+_STATE_LOCK = threading.Lock()
+_CYCLE_LOCK = threading.Lock()
+_WORKER = None
+
+class RateLimiter:
+    """Spaces out calls so at most `per_minute` start in any minute, across threads."""
+
+    def __init__(self, per_minute):
+        self.interval = 60.0 / max(per_minute, 1)
+        self.next_slot = 0.0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot)
+            self.next_slot = slot + self.interval
+        time.sleep(max(0.0, slot - now))
+
+# Shared by the prefetch cycle and login cache misses so together they stay under the API rate
+_LIMITER = RateLimiter(settings.PREFETCH_RATE_PER_MINUTE)
+
+def location_tile(lat, lon):
+    decimals = settings.LOCATION_TILE_DECIMALS
+    return (round(float(lat), decimals), round(float(lon), decimals))
+
+def register_location(lat, lon):
+    tile = location_tile(lat, lon)
+    with _STATE_LOCK:
+        LOCATIONS[tile] = {"lat": tile[0], "lon": tile[1], "last_seen": time.time()}
+    return tile
+
+def load_registered_locations():
+    """Collect tiles with a Weather_data session in the last PREFETCH_ACTIVE_DAYS days."""
+    decimals = settings.LOCATION_TILE_DECIMALS
+    conn = get_db_connection()
+    cursor = conn.cursor(dictionary=True)
+    try:
+        cursor.execute("""
+            SELECT ROUND(latitude, %s) AS lat, ROUND(longitude, %s) AS lon, MAX(created_at) AS last_seen
+            FROM Weather_data
+            WHERE created_at >= NOW() - INTERVAL %s DAY AND latitude IS NOT NULL AND longitude IS NOT NULL
+            GROUP BY ROUND(latitude, %s), ROUND(longitude, %s)
+        """, (decimals, decimals, settings.PREFETCH_ACTIVE_DAYS, decimals, decimals))
+        rows = cursor.fetchall()
+    except Exception as e:
+        print(f"Error loading farm locations: {e}")
+        return
+    finally:
+        cursor.close()
+        conn.close()
+
+    with _STATE_LOCK:
+        for r in rows:
+            tile = location_tile(r["lat"], r["lon"])
+            if tile not in LOCATIONS:
+                LOCATIONS[tile] = {"lat": tile[0], "lon": tile[1], "last_seen": r["last_seen"].timestamp()}
+
+def _prune_locations():
+    horizon = time.time() - settings.PREFETCH_ACTIVE_DAYS * 86400
+    with _STATE_LOCK:
+        for tile in [t for t, loc in LOCATIONS.items() if loc["last_seen"] < horizon]:
+            LOCATIONS.pop(tile, None)
+            FORECASTS.pop(tile, None)
+
+def fresh_forecast(lat, lon):
+    entry = FORECASTS.get(location_tile(lat, lon))
+    if entry and time.time() - entry["fetched_at"] < settings.PREFETCH_MAX_AGE_SECONDS:
+        return entry
+    return None
+
+def _fetch_blocks(tile):
+    """Forecast blocks for one tile; [] on any error so one bad tile never aborts a cycle."""
+    try:
+        _LIMITER.wait()
+        forecast = fetch_forecast_weather(tile[0], tile[1])
+        return process_weather_blocks(forecast, tile[0], tile[1]) if forecast else []
+    except Exception as e:
+        print(f"Error prefetching forecast for {tile}: {e}")
+        return []
+
+def _publish(blocks_by_tile):
+    """Score every location's blocks with one model call and publish them."""
+    tiles = [t for t, blocks in blocks_by_tile.items() if blocks]
+    all_blocks = [b for t in tiles for b in blocks_by_tile[t]]
+    if not all_blocks: return
+
+    try:
+        statuses = iter(score_records(all_blocks))
+    except Exception as e:
+        # Publish the forecasts anyway; the login path will score them itself
+        print(f"Error scoring prefetched forecasts: {e}")
+        statuses = None
+    fetched_at = time.time()
+    with _STATE_LOCK:
+        for tile in tiles:
+            blocks = blocks_by_tile[tile]
+            FORECASTS[tile] = {
+                "fetched_at": fetched_at,
+                "records": blocks,
+                "status": [next(statuses) for _ in blocks] if statuses else None,
+            }
+
+def refresh_all_locations():
+    """One prefetch cycle: fetch every registered tile with bounded concurrency, then score in bulk."""
+    if not _CYCLE_LOCK.acquire(blocking=False):
+        print("Forecast prefetch already running, skipping.")
+        return 0
+
+    try:
+        load_registered_locations()
+        _prune_locations()
+        with _STATE_LOCK:
+            tiles = list(LOCATIONS.keys())
+        print(f"Prefetching forecasts for {len(tiles)} locations...")
+
+        with ThreadPoolExecutor(max_workers=settings.PREFETCH_CONCURRENCY) as pool:
+            blocks = list(pool.map(_fetch_blocks, tiles))
+
+        blocks_by_tile = dict(zip(tiles, blocks))
+        _publish(blocks_by_tile)
+        refreshed = sum(1 for b in blocks if b)
+        print(f"Forecast prefetch completed: {refreshed}/{len(tiles)} locations refreshed.")
+        return refreshed
+    except Exception as e:
+        print(f"Error during forecast prefetch: {e}")
+        return 0
+    finally:
+        _CYCLE_LOCK.release()
+
+def capture_login_forecast(lat, lon, login_unique_key):
+    """
+    Login path: store the session's forecast and spray predictions, reusing the
+    prefetched tile data when fresh and fetching (and caching) it otherwise.
+    The spray pipeline gets this login's own rows, never "the latest session".
+    With PREFETCH_ENABLED off this is the plain per-login capture at the exact coordinates.
+    """
+    if not settings.PREFETCH_ENABLED:
+        session_rows = capture_weather_on_login(lat, lon, login_unique_key)
+        if session_rows:
+            run_spray_prediction(session_rows)
+        return
+
+    tile = register_location(lat, lon)
+    entry = fresh_forecast(lat, lon)
+    if entry is None:
+        _publish({tile: _fetch_blocks(tile)})
+        entry = fresh_forecast(lat, lon)
+
+    if entry is None:
+        # Prefetch fetch failed; let the capture retry against the exact coordinates
+        _LIMITER.wait()
+        session_rows = capture_weather_on_login(lat, lon, login_unique_key)
+        statuses = None
+    else:
+        records = [dict(r, lat=lat, lon=lon) for r in entry["records"]]
+        session_rows = capture_weather_on_login(lat, lon, login_unique_key, records)
+        statuses = {
+            weather_unique_key(login_unique_key, r): status
+            for r, status in zip(records, entry["status"])
+        } if entry["status"] else None
+
+    if session_rows:
+        run_spray_prediction(session_rows, statuses)
+
+def _prefetch_loop():
+    while True:
+        refresh_all_locations()
+        time.sleep(settings.PREFETCH_INTERVAL_SECONDS)
+
+def start_prefetch_worker():
+    """Start the background forecast prefetch thread (idempotent)."""
+    global _WORKER
+    if not settings.PREFETCH_ENABLED: return
+    if _WORKER is not None and _WORKER.is_alive(): return
+    _WORKER = threading.Thread(target=_prefetch_loop, name="forecast-prefetch", daemon=True)
+    _WORKER.start()
+
+if __name__ == "__main__":
+    refresh_all_locations()
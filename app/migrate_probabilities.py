@@ -0,0 +1,185 @@
+# app/migrate_probabilities.py
+"""
+Convert plant_diagnosis rows from the legacy extra_json text to the compact probs_blob.
+
+    python -m app.migrate_probabilities --benchmark 200   # measure only
+    python -m app.migrate_probabilities                   # migrate in batches
+"""
+import argparse
+import json
+import time
+import numpy as np
+from app.db import get_db_connection
+from app.config import settings
+from app.ml_integration import MODEL_CONFIG
+from app.prediction_codec import encode_probabilities, decode_probabilities, stdlib_dumps, orjson
+from app.diagnosis_history import ensure_diagnosis_schema, get_treatment, _has_column
+
+def resolve_crop(row, probs):
+    """Crop of a legacy row: the stored one, else the only model whose classes fit the label and vector."""
+    if row.get("crop") in MODEL_CONFIG:
+        return row["crop"]
+    candidates = [
+        crop for crop, cfg in MODEL_CONFIG.items()
+        if row.get("disease_name") in cfg["classes"] and len(cfg["classes"]) == len(probs)
+    ]
+    return candidates[0] if len(candidates) == 1 else None
+
+def fetch_legacy_rows(cursor, after_id, limit):
+    cursor.execute("""
+        SELECT id, crop, disease_name, extra_json FROM plant_diagnosis
+        WHERE id > %s AND extra_json IS NOT NULL AND probs_blob IS NULL
+        ORDER BY id LIMIT %s
+    """, (after_id, limit))
+    return cursor.fetchall()
+
+def migrate(batch_size=500, keep_json=False, dry_run=False):
+    """
+    Walk legacy rows by id in batches; each batch commits on its own.
+    A dry run never alters the table: it stops if crop / probs_blob are missing.
+    """
+    if not dry_run and not ensure_diagnosis_schema():
+        return 0, 0
+    conn = get_db_connection()
+    cursor = conn.cursor(dictionary=True)
+    converted, skipped, after_id = 0, 0, 0
+    try:
+        missing = [c for c in ("crop", "probs_blob") if not _has_column(cursor, c)]
+        if missing:
+            print(f"plant_diagnosis is missing {', '.join(missing)}; run `python -m app.diagnosis_history` first.")
+            return converted, skipped
+        while True:
+            rows = fetch_legacy_rows(cursor, after_id, batch_size)
+            if not rows: break
+            after_id = rows[-1]["id"]
+
+            updates = []
+            for row in rows:
+                try:
+                    probs = json.loads(row["extra_json"]).get("probabilities") or []
+                except (TypeError, ValueError):
+                    probs = []
+                crop = resolve_crop(row, probs)
+                if not probs or crop is None:
+                    skipped += 1
+                    continue
+                blob = encode_probabilities(probs, settings.PROBABILITY_TOP_K, settings.PROBABILITY_DTYPE)
+                updates.append((crop, blob, row["extra_json"] if keep_json else None, row["id"]))
+
+            if updates and not dry_run:
+                cursor.executemany(
+                    "UPDATE plant_diagnosis SET crop = %s, probs_blob = %s, extra_json = %s WHERE id = %s",
+                    updates
+                )
+                conn.commit()
+            converted += len(updates)
+            print(f"Migrated up to id {after_id}: {converted} converted, {skipped} skipped")
+    finally:
+        cursor.close()
+        conn.close()
+    return converted, skipped
+
+def _time_per_call(fn, items, repeat=5):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for item in items:
+            fn(item)
+        best = min(best, time.perf_counter() - start)
+    return best / max(len(items), 1) * 1e6
+
+def synthetic_samples(count):
+    """Softmax vectors for random crops, shaped like real predict_image_for_crop output."""
+    rng = np.random.default_rng(0)
+    crops = list(MODEL_CONFIG.keys())
+    samples = []
+    for i in range(count):
+        crop = crops[i % len(crops)]
+        classes = MODEL_CONFIG[crop]["classes"]
+        logits = rng.normal(size=len(classes)) * 3
+        probs = np.exp(logits - logits.max())
+        probs /= probs.sum()
+        label = classes[int(np.argmax(probs))]
+        treatment = {
+            "disease": label,
+            "chemical_pesticides": "Consult local expert",
+            "cause_prevention": "Ensure good field hygiene"
+        }
+        extra_json = json.dumps({"probabilities": probs.tolist(), "treatment": treatment, "model_used": "HF_Hub_Model"})
+        samples.append({"crop": crop, "disease_name": label, "extra_json": extra_json})
+    return samples
+
+def _encoders():
+    encoders = {"stdlib": stdlib_dumps}
+    if orjson is not None:
+        encoders["orjson"] = lambda obj: orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY)
+    return encoders
+
+def benchmark(samples, treatment_lookup=get_treatment):
+    """
+    Row payload size and response serialization time, legacy text vs compact blob,
+    per JSON encoder. The compact side serializes the treatment the read path
+    actually returns (treatment_lookup), so both sides carry the same payload.
+    """
+    legacy, compact = [], []
+    for row in samples:
+        probs = json.loads(row["extra_json"]).get("probabilities") or []
+        crop = resolve_crop(row, probs)
+        if not probs or crop is None: continue
+        legacy.append(row["extra_json"])
+        compact.append((encode_probabilities(probs, settings.PROBABILITY_TOP_K, settings.PROBABILITY_DTYPE),
+                        MODEL_CONFIG[crop]["classes"], treatment_lookup(row["disease_name"])))
+    if not legacy:
+        print("No convertible rows to benchmark.")
+        return {}
+
+    report = {
+        "rows": len(legacy),
+        "avg_legacy_bytes": sum(len(x.encode("utf-8")) for x in legacy) / len(legacy),
+        "avg_compact_bytes": sum(len(b) for b, _, _ in compact) / len(compact),
+    }
+    for name, encode in _encoders().items():
+        report[f"legacy_{name}_us"] = _time_per_call(lambda x: encode(json.loads(x)), legacy)
+        report[f"compact_{name}_us"] = _time_per_call(
+            lambda c: encode({"top_predictions": decode_probabilities(c[0], c[1]), "treatment": c[2]}),
+            compact
+        )
+    if orjson is None:
+        print("orjson is not installed; only the stdlib encoder was measured.")
+    for key, value in report.items():
+        print(f"{key:>22}: {value:.2f}" if isinstance(value, float) else f"{key:>22}: {value}")
+    return report
+
+def load_benchmark_samples(count):
+    conn = get_db_connection()
+    cursor = conn.cursor(dictionary=True)
+    try:
+        cursor.execute("""
+            SELECT id, crop, disease_name, extra_json FROM plant_diagnosis
+            WHERE extra_json IS NOT NULL ORDER BY id DESC LIMIT %s
+        """, (count,))
+        return cursor.fetchall()
+    finally:
+        cursor.close()
+        conn.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--keep-json", action="store_true", help="leave extra_json in place after converting")
+    parser.add_argument("--dry-run", action="store_true", help="convert without writing")
+    parser.add_argument("--benchmark", type=int, metavar="N", help="benchmark N recent rows and exit")
+    parser.add_argument("--synthetic", action="store_true", help="benchmark generated rows instead of the DB")
+    args = parser.parse_args()
+
+    if args.benchmark or args.synthetic:
+        count = args.benchmark or 200
+        if args.synthetic:
+            # Synthetic rows carry the fallback treatment, which is what get_treatment returns for them
+            samples = synthetic_samples(count)
+            treatments = {r["disease_name"]: json.loads(r["extra_json"])["treatment"] for r in samples}
+            benchmark(samples, treatments.get)
+        else:
+            benchmark(load_benchmark_samples(count))
+    else:
+        migrate(args.batch_size, args.keep_json, args.dry_run)
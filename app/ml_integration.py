@@ -149,7 +149,7 @@ def predict_image_for_crop(image_path: str, crop_key: str) -> Dict[str, Any]:
         "label": top_label,
         "index": top_index,
         "confidence": confidence,
-        "probabilities": probs.tolist(),
+        "probabilities": probs,
         "model_file": "HF_Hub_Model",
         "crop": crop_key
     }
@@ -179,5 +179,5 @@ def predict_crop_type(image_path: str) -> Dict[str, Any]:
     return {
         "label": top_label,
         "confidence": confidence,
-        "probabilities": probs.tolist()
+        "probabilities": probs
     }
@@ -0,0 +1,71 @@
+# app/prediction_codec.py
+import json
+import struct
+from decimal import Decimal
+import numpy as np
+
+try:
+    import orjson
+except ImportError:  # fall back to the stdlib encoder
+    orjson = None
+
+# Blob layout (little endian):
+#   header  <BBB   version, dtype code, k
+#   indices <kH    class indices of the top-k predictions, best first
+#   probs          k x uint8 (p * 255) or k x float16
+BLOB_VERSION = 1
+DTYPE_UINT8 = 1
+DTYPE_FLOAT16 = 2
+DTYPE_CODES = {"uint8": DTYPE_UINT8, "float16": DTYPE_FLOAT16}
+_HEADER = struct.Struct("<BBB")
+
+def encode_probabilities(probs, top_k=3, dtype="uint8") -> bytes:
+    """Pack the top-k class indices and their quantized probabilities."""
+    probs = np.asarray(probs, dtype=np.float32).reshape(-1)
+    k = min(top_k, probs.size, 255)
+    top = np.argsort(probs)[::-1][:k]
+
+    code = DTYPE_CODES[dtype]
+    if code == DTYPE_UINT8:
+        quantized = np.rint(np.clip(probs[top], 0.0, 1.0) * 255).astype("<u1")
+    else:
+        quantized = probs[top].astype("<f2")
+    return _HEADER.pack(BLOB_VERSION, code, k) + top.astype("<u2").tobytes() + quantized.tobytes()
+
+def decode_probabilities(blob, classes=None):
+    """Unpack a blob into [{"index", "label", "probability"}], best first."""
+    if not blob: return []
+    blob = bytes(blob)
+    version, code, k = _HEADER.unpack_from(blob)
+    if version != BLOB_VERSION:
+        raise ValueError(f"Unsupported probability blob version {version}")
+
+    offset = _HEADER.size
+    indices = np.frombuffer(blob, dtype="<u2", count=k, offset=offset)
+    offset += 2 * k
+    if code == DTYPE_UINT8:
+        probs = np.frombuffer(blob, dtype="<u1", count=k, offset=offset).astype(np.float32) / 255.0
+    else:
+        probs = np.frombuffer(blob, dtype="<f2", count=k, offset=offset).astype(np.float32)
+
+    results = []
+    for idx, p in zip(indices.tolist(), probs.tolist()):
+        label = classes[idx] if classes and idx < len(classes) else str(idx)
+        results.append({"index": idx, "label": label, "probability": round(p, 4)})
+    return results
+
+def _default(obj):
+    if hasattr(obj, "isoformat"): return obj.isoformat()
+    if isinstance(obj, Decimal): return float(obj)
+    if isinstance(obj, np.ndarray): return obj.tolist()
+    if isinstance(obj, np.generic): return obj.item()
+    return str(obj)
+
+def dumps(obj) -> bytes:
+    """Compact JSON bytes, via orjson when it is installed."""
+    if orjson is not None:
+        return orjson.dumps(obj, default=_default, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+    return stdlib_dumps(obj)
+
+def stdlib_dumps(obj) -> bytes:
+    return json.dumps(obj, separators=(",", ":"), default=_default).encode("utf-8")
@@ -0,0 +1,211 @@
+# app/retention.py
+import time
+import threading
+import datetime
+from app.db import get_db_connection
+from app.config import settings
+from app.weather_service import init_weather_table
+from app.spray_prediction import create_prediction_table, create_best_window_table
+
+# Tables that grow by one session per login (keyed by created_at)
+RETAINED_TABLES = ["Weather_data", "Spray_time_prediction", "Spray_best_window"]
+ARCHIVE_SUFFIX = "_archive"
+
+# === STATE ===
+LAST_REPORT = {}
+_RUN_LOCK = threading.Lock()
+_WORKER = None
+
+def _has_index_on(cursor, table, column):
+    cursor.execute("""
+        SELECT 1 FROM information_schema.STATISTICS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND COLUMN_NAME = %s AND SEQ_IN_INDEX = 1
+        LIMIT 1
+    """, (table, column))
+    return cursor.fetchone() is not None
+
+def _drop_secondary_unique(cursor, table):
+    """
+    Archive tables keep only the id primary key: session keys (unique_column) do recur,
+    so a UNIQUE copied over by LIKE would make a later archive INSERT collide.
+    """
+    cursor.execute("""
+        SELECT DISTINCT INDEX_NAME FROM information_schema.STATISTICS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND NON_UNIQUE = 0 AND INDEX_NAME <> 'PRIMARY'
+    """, (table,))
+    for (index_name,) in cursor.fetchall():
+        cursor.execute(f"ALTER TABLE {table} DROP INDEX `{index_name}`")
+
+def ensure_retention_schema():
+    """Create the archive tables and the created_at indexes used by session lookups."""
+    init_weather_table()
+    create_prediction_table()
+    create_best_window_table()
+
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        for table in RETAINED_TABLES:
+            if not _has_index_on(cursor, table, "created_at"):
+                cursor.execute(f"ALTER TABLE {table} ADD INDEX idx_{table.lower()}_created_at (created_at)")
+            if settings.RETENTION_ARCHIVE:
+                cursor.execute(f"CREATE TABLE IF NOT EXISTS {table}{ARCHIVE_SUFFIX} LIKE {table}")
+                _drop_secondary_unique(cursor, table + ARCHIVE_SUFFIX)
+        conn.commit()
+    except Exception as e:
+        print(f"Error ensuring retention schema: {e}")
+    finally:
+        cursor.close()
+        conn.close()
+
+def table_size_report():
+    """Approximate row counts and on-disk sizes for the retained and archive tables."""
+    tables = RETAINED_TABLES + [t + ARCHIVE_SUFFIX for t in RETAINED_TABLES]
+    placeholders = ", ".join(["%s"] * len(tables))
+    conn = get_db_connection()
+    cursor = conn.cursor(dictionary=True)
+    try:
+        cursor.execute(f"""
+            SELECT TABLE_NAME AS table_name, TABLE_ROWS AS approx_rows,
+                   DATA_LENGTH AS data_bytes, INDEX_LENGTH AS index_bytes, DATA_FREE AS free_bytes
+            FROM information_schema.TABLES
+            WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME IN ({placeholders})
+        """, tables)
+        return {row["table_name"]: row for row in cursor.fetchall()}
+    except Exception as e:
+        print(f"Error reading table sizes: {e}")
+        return {}
+    finally:
+        cursor.close()
+        conn.close()
+
+def find_stale_sessions(cursor, table, cutoff, keep):
+    """Session timestamps older than cutoff that are not the latest session of any tile."""
+    cursor.execute(f"SELECT DISTINCT created_at FROM {table} WHERE created_at < %s", (cutoff,))
+    return [r["created_at"] for r in cursor.fetchall() if r["created_at"] not in keep]
+
+def latest_session_per_tile(cursor):
+    """
+    Latest session timestamp for every location tile. Tiles are lat/lon rounded to
+    LOCATION_TILE_DECIMALS (2 decimals is roughly a 1 km cell).
+    """
+    decimals = settings.LOCATION_TILE_DECIMALS
+    cursor.execute("""
+        SELECT MAX(created_at) AS latest
+        FROM Weather_data
+        GROUP BY ROUND(latitude, %s), ROUND(longitude, %s)
+    """, (decimals, decimals))
+    return {r["latest"] for r in cursor.fetchall()}
+
+def compact_sessions(table, session_times):
+    """
+    Move (or delete) all rows of the given sessions in small batches.
+    Every batch is its own short transaction so row locks are released quickly.
+    Returns (rows_reclaimed, error); on error the failing batch is rolled back and compaction stops.
+    """
+    batch_size = settings.RETENTION_BATCH_SIZE
+    reclaimed, error = 0, None
+    if not session_times: return reclaimed, error
+
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        for start in range(0, len(session_times), batch_size):
+            chunk = session_times[start:start + batch_size]
+            chunk_placeholders = ", ".join(["%s"] * len(chunk))
+            while True:
+                cursor.execute(
+                    f"SELECT id FROM {table} WHERE created_at IN ({chunk_placeholders}) ORDER BY id LIMIT %s",
+                    (*chunk, batch_size)
+                )
+                ids = [r[0] for r in cursor.fetchall()]
+                if not ids: break
+
+                id_placeholders = ", ".join(["%s"] * len(ids))
+                if settings.RETENTION_ARCHIVE:
+                    # Plain INSERT: a collision in the archive must abort the batch, never drop rows
+                    cursor.execute(
+                        f"INSERT INTO {table}{ARCHIVE_SUFFIX} SELECT * FROM {table} WHERE id IN ({id_placeholders})",
+                        ids
+                    )
+                    if cursor.rowcount != len(ids):
+                        raise RuntimeError(f"archived {cursor.rowcount} of {len(ids)} rows")
+                cursor.execute(f"DELETE FROM {table} WHERE id IN ({id_placeholders})", ids)
+                conn.commit()
+                reclaimed += cursor.rowcount
+                time.sleep(settings.RETENTION_BATCH_PAUSE_SECONDS)
+    except Exception as e:
+        conn.rollback()
+        error = str(e)
+        print(f"Error compacting {table}, batch rolled back: {e}")
+    finally:
+        cursor.close()
+        conn.close()
+    return reclaimed, error
+
+def run_retention():
+    """
+    Keep every session newer than the retention horizon, and beyond it only the
+    latest session per location tile. Returns a report of rows reclaimed and table sizes.
+    """
+    global LAST_REPORT
+    if not _RUN_LOCK.acquire(blocking=False):
+        print("Retention already running, skipping.")
+        return LAST_REPORT
+
+    try:
+        print("Starting retention compaction...")
+        ensure_retention_schema()
+        started_at = datetime.datetime.utcnow()
+        sizes_before = table_size_report()
+
+        conn = get_db_connection()
+        cursor = conn.cursor(dictionary=True)
+        try:
+            cursor.execute("SELECT NOW() - INTERVAL %s DAY AS cutoff", (settings.RETENTION_HORIZON_DAYS,))
+            cutoff = cursor.fetchone()["cutoff"]
+            keep = latest_session_per_tile(cursor)
+            stale = {table: find_stale_sessions(cursor, table, cutoff, keep) for table in RETAINED_TABLES}
+        finally:
+            cursor.close()
+            conn.close()
+
+        results = {table: compact_sessions(table, sessions) for table, sessions in stale.items()}
+        reclaimed = {table: r[0] for table, r in results.items()}
+        errors = {table: r[1] for table, r in results.items() if r[1]}
+
+        LAST_REPORT = {
+            "started_at": started_at,
+            "finished_at": datetime.datetime.utcnow(),
+            "cutoff": cutoff,
+            "horizon_days": settings.RETENTION_HORIZON_DAYS,
+            "archived": settings.RETENTION_ARCHIVE,
+            "sessions_compacted": {table: len(sessions) for table, sessions in stale.items()},
+            "rows_reclaimed": reclaimed,
+            "errors": errors,
+            "tables_before": sizes_before,
+            "tables_after": table_size_report(),
+        }
+        print(f"Retention completed. Rows reclaimed: {reclaimed}")
+        return LAST_REPORT
+    except Exception as e:
+        print(f"Error running retention: {e}")
+        return LAST_REPORT
+    finally:
+        _RUN_LOCK.release()
+
+def _retention_loop():
+    while True:
+        run_retention()
+        time.sleep(settings.RETENTION_INTERVAL_SECONDS)
+
+def start_retention_worker():
+    """Start the background compaction thread (idempotent)."""
+    global _WORKER
+    if not settings.RETENTION_ENABLED: return
+    if _WORKER is not None and _WORKER.is_alive(): return
+    _WORKER = threading.Thread(target=_retention_loop, name="retention-worker", daemon=True)
+    _WORKER.start()
+
+if __name__ == "__main__":
+    print(run_retention())
@@ -1,17 +1,23 @@
 # app/routes.py
-from fastapi import APIRouter, UploadFile, File, HTTPException, Form
+from fastapi import APIRouter, UploadFile, File, HTTPException, Form, BackgroundTasks, Header, Response, Query, Depends
 from pydantic import BaseModel
 from datetime import datetime
 import uuid
 import os
 import json
+import secrets
 
 from app.db import get_db_connection
 from app.utils import allowed_file, save_upload, ensure_upload_folder
 from app.config import settings
 from app.ml_integration import predict_image_for_crop, predict_crop_type, normalize_crop_name
-from app.weather_service import capture_weather_on_login
-from app.spray_prediction import run_spray_prediction
+from app.spray_prediction import load_best_windows
+from app.forecast_scheduler import capture_login_forecast
+from app.diagnosis_history import (
+    list_diagnoses, get_diagnosis_cached, invalidate_diagnosis, get_treatment, SCHEMA_READY, SchemaNotReady
+)
+from app.prediction_codec import encode_probabilities
+from app import retention
 
 class WeatherRequest(BaseModel):
     latitude: float
@@ -23,9 +29,8 @@ router = APIRouter()
 @router.post("/weather/capture-login")
 def trigger_weather_capture(data: WeatherRequest):
     try:
-        capture_weather_on_login(data.latitude, data.longitude, data.session_id)
-        # Also run spray prediction pipeline immediately after weather capture
-        run_spray_prediction()
+        # Reuses the prefetched forecast and spray scores for this location when fresh
+        capture_login_forecast(data.latitude, data.longitude, data.session_id)
         return {"success": True, "message": "Weather data captured and processed."}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -127,37 +132,33 @@ async def predict_crop(crop: str, diagnosis_id: int = Form(None), image: UploadF
             "detected": predicted_label, "confidence": confidence
         }
 
-    # Fetch pesticide info from DB, fallback to code-dict
+    pesticide_info = get_treatment(predicted_label)
     conn = get_db_connection()
-    cursor = conn.cursor(dictionary=True)
-    # Check if table exists (optional, assuming it stands)
-    try:
-        cursor.execute("SELECT * FROM pesticide_recommendation WHERE disease = %s", (predicted_label,))
-        pesticide_info = cursor.fetchone()
-    except Exception:
-        pesticide_info = None
-    
-    # If not found in DB, return empty or default structure
-    if not pesticide_info:
-        pesticide_info = {
-            "disease": predicted_label,
-            "chemical_pesticides": "Consult local expert",
-            "cause_prevention": "Ensure good field hygiene"
-        }
-
-    extra_json = json.dumps({
-        "probabilities": result.get("probabilities", []),
-        "treatment": pesticide_info,
-        "model_used": result.get("model_file")
-    })
-    
-    cursor.execute(
-        "UPDATE plant_diagnosis SET disease_name = %s, confidence = %s, extra_json = %s, updated_at = %s WHERE id = %s",
-        (predicted_label, confidence, extra_json, datetime.utcnow(), diagnosis_id)
-    )
+    cursor = conn.cursor()
+    if SCHEMA_READY.is_set():
+        # Compact row: top-k blob, treatment referenced by disease label
+        probs_blob = encode_probabilities(
+            result["probabilities"], settings.PROBABILITY_TOP_K, settings.PROBABILITY_DTYPE
+        )
+        cursor.execute(
+            "UPDATE plant_diagnosis SET crop = %s, disease_name = %s, confidence = %s, probs_blob = %s, extra_json = NULL, updated_at = %s WHERE id = %s",
+            (result["crop"], predicted_label, confidence, probs_blob, datetime.utcnow(), diagnosis_id)
+        )
+    else:
+        # Columns not migrated yet: legacy row, converted later by app.migrate_probabilities
+        extra_json = json.dumps({
+            "probabilities": result["probabilities"].tolist(),
+            "treatment": pesticide_info,
+            "model_used": result.get("model_file")
+        })
+        cursor.execute(
+            "UPDATE plant_diagnosis SET disease_name = %s, confidence = %s, extra_json = %s, updated_at = %s WHERE id = %s",
+            (predicted_label, confidence, extra_json, datetime.utcnow(), diagnosis_id)
+        )
     conn.commit()
     cursor.close()
     conn.close()
+    invalidate_diagnosis(diagnosis_id)
 
     return {
         "success": True, "diagnosis_id": diagnosis_id,
@@ -165,52 +166,53 @@ async def predict_crop(crop: str, diagnosis_id: int = Form(None), image: UploadF
         "treatment_info": pesticide_info, "created_new_row": created_new_row
     }
 
+@router.get("/diagnoses")
+def list_diagnosis_history(username: str = None, crop: str = None, disease: str = None,
+                           cursor: str = None, limit: int = Query(None, ge=1), full: bool = False):
+    try:
+        rows, next_cursor = list_diagnoses(
+            username=username, crop=normalize_crop_name(crop) if crop else None, disease=disease,
+            cursor_token=cursor, limit=limit, full=full
+        )
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    except SchemaNotReady as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    return {"success": True, "diagnoses": rows, "next_cursor": next_cursor}
+
 @router.get("/diagnosis/{diagnosis_id}")
 def get_diagnosis(diagnosis_id: int):
-    conn = get_db_connection()
-    cursor = conn.cursor(dictionary=True)
-    cursor.execute("SELECT * FROM plant_diagnosis WHERE id = %s", (diagnosis_id,))
-    row = cursor.fetchone()
-    cursor.close()
-    conn.close()
+    row = get_diagnosis_cached(diagnosis_id)
     if not row: raise HTTPException(status_code=404, detail="Not found")
-    if row.get("image_path"): row["image_path"] = row["image_path"].replace("\\", "/")
     return {"success": True, "diagnosis": row}
 
 @router.get("/spray/best-time")
-def get_best_spray_time():
-    conn = get_db_connection()
-    cursor = conn.cursor(dictionary=True)
+def get_best_spray_time(if_none_match: str = Header(None)):
     try:
-        cursor.execute("SELECT created_at FROM Weather_data ORDER BY id DESC LIMIT 1")
-        last_row = cursor.fetchone()
-        if not last_row: return {"success": True, "data": []}
-        
-        session_time = last_row['created_at']
-        cursor.execute("""
-            SELECT temperature_c, humidity_percent, rainfall_mm, forecast_date, status 
-            FROM Spray_time_prediction 
-            WHERE created_at = %s AND (status = '1' OR status = '1.0')
-            ORDER BY forecast_date ASC
-        """, (session_time,))
-        records = cursor.fetchall()
-        
-        # Grouping logic
-        from collections import defaultdict
-        grouped = defaultdict(list)
-        for r in records:
-            if not r['forecast_date']: continue
-            hour = r['forecast_date'].hour
-            if 4 <= hour < 22:
-                grouped[r['forecast_date'].date()].append(r)
-        
-        results = []
-        for day in sorted(grouped.keys()):
-            results.extend(grouped[day][:2])
-            
-        return {"success": True, "data": results}
+        etag, body = load_best_windows()
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        cursor.close()
-        conn.close()
+
+    headers = {"ETag": etag, "Cache-Control": settings.SPRAY_CACHE_CONTROL}
+    if if_none_match:
+        candidates = {t.strip().removeprefix("W/") for t in if_none_match.split(",")}
+        if etag in candidates or "*" in candidates:
+            return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+def require_admin(x_admin_token: str = Header(None)):
+    if not settings.ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not found")
+    if not x_admin_token or not secrets.compare_digest(x_admin_token, settings.ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Forbidden")
+
+@router.get("/maintenance/retention", dependencies=[Depends(require_admin)])
+def get_retention_report():
+    return {"success": True, "last_run": retention.LAST_REPORT, "tables": retention.table_size_report()}
+
+@router.post("/maintenance/retention/run", dependencies=[Depends(require_admin)])
+def trigger_retention(background_tasks: BackgroundTasks):
+    background_tasks.add_task(retention.run_retention)
+    return {"success": True, "message": "Retention compaction scheduled."}
@@ -1,8 +1,17 @@
 # app/spray_prediction.py
 import mysql.connector
 import numpy as np
+import hashlib
+import threading
+from collections import defaultdict
 from app.db import get_db_connection
 from app.ml_integration import get_spray_model
+from app.prediction_codec import dumps
+
+# === BEST WINDOW CACHE ===
+# Latest precomputed /spray/best-time response: {"session": created_at, "etag": str, "body": bytes}
+BEST_WINDOW = None
+_BEST_WINDOW_LOCK = threading.Lock()
 
 def create_prediction_table():
     conn = get_db_connection()
@@ -30,6 +39,27 @@ def create_prediction_table():
         cursor.close()
         conn.close()
 
+def create_best_window_table():
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    table_query = """
+    CREATE TABLE IF NOT EXISTS Spray_best_window (
+        id INT AUTO_INCREMENT PRIMARY KEY,
+        created_at DATETIME NOT NULL,
+        etag VARCHAR(64) NOT NULL,
+        payload MEDIUMBLOB NOT NULL,
+        UNIQUE(created_at)
+    );
+    """
+    try:
+        cursor.execute(table_query)
+        conn.commit()
+    except Exception as e:
+        print(f"Error creating best window table: {e}")
+    finally:
+        cursor.close()
+        conn.close()
+
 def fetch_latest_session_records():
     conn = get_db_connection()
     cursor = conn.cursor(dictionary=True)
@@ -48,22 +78,40 @@ def fetch_latest_session_records():
         cursor.close()
         conn.close()
 
-def generate_predictions(records):
+def score_records(records):
+    """Spray status for every record with a single model call."""
+    if not records: return []
+    features = np.array([
+        [r['temperature_c'], r['humidity_percent'], r['rainfall_mm']] for r in records
+    ], dtype=float)
+    return list(get_spray_model().predict(features))
+
+def generate_predictions(records, precomputed_status=None):
+    """
+    precomputed_status: optional {unique_column: status} scored by the forecast prefetcher
+    for exactly these rows; only rows missing from it are sent to the model.
+    """
     predictions = []
     if not records: return []
-    
+    precomputed_status = precomputed_status or {}
+
+    pending = [row for row in records if row['unique_column'] not in precomputed_status]
+    scored = {}
+    try:
+        scored = {id(row): status for row, status in zip(pending, score_records(pending))}
+    except Exception as e:
+        print(f"Batch spray scoring failed, scoring row by row: {e}")
+        for row in pending:
+            try:
+                scored[id(row)] = score_records([row])[0]
+            except Exception as e:
+                print(f"Error predicting for row {row.get('id')}: {e}")
+
     for row in records:
-        try:
-            features = [[
-                row['temperature_c'],
-                row['humidity_percent'],
-                row['rainfall_mm']
-            ]]
-            pred = get_spray_model().predict(features)
-            status = pred[0]
-            predictions.append({"original_row": row, "status": status})
-        except Exception as e:
-            print(f"Error predicting for row {row.get('id')}: {e}")
+        if row['unique_column'] in precomputed_status:
+            predictions.append({"original_row": row, "status": precomputed_status[row['unique_column']]})
+        elif id(row) in scored:
+            predictions.append({"original_row": row, "status": scored[id(row)]})
     return predictions
 
 def store_prediction_records(predictions):
@@ -91,13 +139,126 @@ def store_prediction_records(predictions):
         cursor.close()
         conn.close()
 
-def run_spray_prediction():
+def select_best_windows(records):
+    """
+    Pick spray-suitable slots between 04:00 and 22:00, first two per day.
+    records: dicts with temperature_c, humidity_percent, rainfall_mm, forecast_date, status.
+    """
+    grouped = defaultdict(list)
+    suitable = [r for r in records if r['forecast_date'] and str(r['status']) in ('1', '1.0')]
+    for r in sorted(suitable, key=lambda r: r['forecast_date']):
+        if 4 <= r['forecast_date'].hour < 22:
+            grouped[r['forecast_date'].date()].append(r)
+
+    results = []
+    for day in sorted(grouped.keys()):
+        results.extend(grouped[day][:2])
+    return results
+
+def encode_best_windows(results):
+    """Serialize the /spray/best-time body once and derive its ETag."""
+    data = [{
+        "temperature_c": r['temperature_c'],
+        "humidity_percent": r['humidity_percent'],
+        "rainfall_mm": r['rainfall_mm'],
+        "forecast_date": r['forecast_date'].isoformat(),
+        "status": str(r['status'])
+    } for r in results]
+    body = dumps({"success": True, "data": data})
+    etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+    return etag, body
+
+def remember_best_windows(session_time, etag, body, overwrite=True):
+    global BEST_WINDOW
+    with _BEST_WINDOW_LOCK:
+        if BEST_WINDOW is None or BEST_WINDOW["session"] < session_time or \
+                (overwrite and BEST_WINDOW["session"] == session_time):
+            BEST_WINDOW = {"session": session_time, "etag": etag, "body": body}
+
+def store_best_windows(session_time, etag, body, overwrite=True):
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    on_duplicate = "etag=VALUES(etag), payload=VALUES(payload)" if overwrite else "etag=etag"
+    try:
+        cursor.execute(
+            f"""
+            INSERT INTO Spray_best_window (created_at, etag, payload) VALUES (%s, %s, %s)
+            ON DUPLICATE KEY UPDATE {on_duplicate}
+            """,
+            (session_time, etag, body)
+        )
+        conn.commit()
+    except Exception as e:
+        print(f"Error storing best windows: {e}")
+    finally:
+        cursor.close()
+        conn.close()
+
+def precompute_best_windows(session_time, predictions):
+    """
+    Build the best-window response for a freshly scored session, in memory and in the DB.
+    Published even when scoring produced nothing, so the endpoint moves on to the new session.
+    """
+    records = [dict(p['original_row'], status=p['status']) for p in predictions]
+    etag, body = encode_best_windows(select_best_windows(records))
+    remember_best_windows(session_time, etag, body)
+    store_best_windows(session_time, etag, body)
+
+def load_best_windows():
+    """
+    Latest best-window response as (etag, body). Served from memory when warm,
+    otherwise from Spray_best_window, otherwise rebuilt from Spray_time_prediction.
+    """
+    cached = BEST_WINDOW
+    if cached is not None:
+        return cached["etag"], cached["body"]
+
+    conn = get_db_connection()
+    cursor = conn.cursor(dictionary=True)
+    try:
+        cursor.execute("SELECT created_at FROM Weather_data ORDER BY id DESC LIMIT 1")
+        last_row = cursor.fetchone()
+        if not last_row:
+            return encode_best_windows([])
+
+        session_time = last_row['created_at']
+        try:
+            cursor.execute("SELECT etag, payload FROM Spray_best_window WHERE created_at = %s", (session_time,))
+            stored = cursor.fetchone()
+        except mysql.connector.Error:
+            stored = None
+
+        if stored:
+            etag, body = stored['etag'], bytes(stored['payload'])
+        else:
+            cursor.execute("""
+                SELECT temperature_c, humidity_percent, rainfall_mm, forecast_date, status
+                FROM Spray_time_prediction
+                WHERE created_at = %s AND (status = '1' OR status = '1.0')
+                ORDER BY forecast_date ASC
+            """, (session_time,))
+            etag, body = encode_best_windows(select_best_windows(cursor.fetchall()))
+    finally:
+        cursor.close()
+        conn.close()
+
+    # Never clobber a result the pipeline published for the same session meanwhile
+    remember_best_windows(session_time, etag, body, overwrite=False)
+    if not stored:
+        store_best_windows(session_time, etag, body, overwrite=False)
+    return etag, body
+
+def run_spray_prediction(records=None, precomputed_status=None):
+    """records: the session's Weather_data rows; defaults to the latest session in the table."""
     print("Starting Spray Prediction...")
     create_prediction_table()
-    records = fetch_latest_session_records()
+    create_best_window_table()
+    if records is None:
+        records = fetch_latest_session_records()
     if records:
-        preds = generate_predictions(records)
+        preds = generate_predictions(records, precomputed_status)
         store_prediction_records(preds)
+        precompute_best_windows(records[0]['created_at'], preds)
     print("Pipeline completed.")
 
 if __name__ == "__main__":
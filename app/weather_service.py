@@ -22,7 +22,8 @@ def init_weather_table():
         latitude DOUBLE NULL,
         longitude DOUBLE NULL,
         source VARCHAR(255) NULL,
-        unique_column VARCHAR(255) UNIQUE
+        unique_column VARCHAR(255) UNIQUE,
+        INDEX(created_at)
     );
     """
     try:
@@ -44,7 +45,7 @@ def fetch_forecast_weather(lat, lon):
 
     url = f"https://api.openweathermap.org/data/2.5/forecast?lat={lat}&lon={lon}&appid={api_key}&units=metric"
     try:
-        response = requests.get(url)
+        response = requests.get(url, timeout=15)
         response.raise_for_status()
         return response.json()
     except Exception as e:
@@ -116,6 +117,9 @@ def process_weather_blocks(forecast_data, lat, lon):
             })
     return processed_records
 
+def weather_unique_key(login_unique_key, record):
+    return f"{login_unique_key}_{record['day_index']}_{record['block_index']}"
+
 def db_insert_weather_records(records, login_unique_key):
     """Insert processed records into Weather_data table."""
     conn = get_db_connection()
@@ -134,7 +138,7 @@ def db_insert_weather_records(records, login_unique_key):
     try:
         data_to_insert = []
         for r in records:
-            unique_col = f"{login_unique_key}_{r['day_index']}_{r['block_index']}"
+            unique_col = weather_unique_key(login_unique_key, r)
             data_to_insert.append((
                 r["temperature_c"], r["humidity_percent"], r["rainfall_mm"],
                 r["forecast_date"], r["lat"], r["lon"], "OpenWeatherMap", unique_col
@@ -147,13 +151,34 @@ def db_insert_weather_records(records, login_unique_key):
         cursor.close()
         conn.close()
 
-def capture_weather_on_login(lat, lon, login_unique_key):
+def fetch_session_records(login_unique_key, records):
+    """Read back the Weather_data rows this login stored (with their created_at)."""
+    keys = [weather_unique_key(login_unique_key, r) for r in records]
+    if not keys: return []
+    conn = get_db_connection()
+    cursor = conn.cursor(dictionary=True)
+    try:
+        placeholders = ", ".join(["%s"] * len(keys))
+        cursor.execute(f"SELECT * FROM Weather_data WHERE unique_column IN ({placeholders})", keys)
+        return cursor.fetchall()
+    except Exception as e:
+        print(f"Error fetching session records: {e}")
+        return []
+    finally:
+        cursor.close()
+        conn.close()
+
+def capture_weather_on_login(lat, lon, login_unique_key, processed_records=None):
+    """
+    Store this login's forecast blocks and return its Weather_data rows.
+    processed_records: already processed blocks (e.g. prefetched); fetched from OpenWeather when None.
+    """
     print(f"Starting weather capture for {lat}, {lon} | Session: {login_unique_key}")
     init_weather_table()
-    forecast = fetch_forecast_weather(lat, lon)
-    if forecast:
-        processed_records = process_weather_blocks(forecast, lat, lon)
-        if processed_records:
-            db_insert_weather_records(processed_records, login_unique_key)
-
-
+    if processed_records is None:
+        forecast = fetch_forecast_weather(lat, lon)
+        processed_records = process_weather_blocks(forecast, lat, lon) if forecast else []
+    if not processed_records:
+        return []
+    db_insert_weather_records(processed_records, login_unique_key)
+    return fetch_session_records(login_unique_key, processed_records)
@@ -1,9 +1,15 @@
 import os
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, ORJSONResponse
 from app.routes import router
+from app.retention import start_retention_worker
+from app.forecast_scheduler import start_prefetch_worker
+from app.diagnosis_history import start_schema_worker
+from app.prediction_codec import orjson
 
-app = FastAPI()
+# orjson is much faster than the stdlib encoder; keep working if it is not installed
+app = FastAPI(default_response_class=ORJSONResponse if orjson is not None else JSONResponse)
 
 # --------------------------------------------------
 # CORS Configuration (Allow all Vercel deployments)
@@ -21,6 +27,15 @@ app.add_middleware(
 # --------------------------------------------------
 app.include_router(router)
 
+# --------------------------------------------------
+# Background Workers
+# --------------------------------------------------
+@app.on_event("startup")
+def start_background_workers():
+    start_schema_worker()
+    start_retention_worker()
+    start_prefetch_worker()
+
 # --------------------------------------------------
 # Health Check
 # --------------------------------------------------